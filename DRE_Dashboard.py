@@ -1,36 +1,54 @@
-import ast
 import datetime
 import enum
+from importlib.metadata import version
 from pathlib import Path
 
 import pandas as pd
-import pkg_resources
 import plotly.express as px
+import plotly.graph_objects as go
+import pyarrow.parquet as pq
 import pydeck as pdk
 import streamlit as st
 import streamlit_authenticator as stauth
 import yaml
-from yaml.loader import SafeLoader
 
-from utils.db import get_dubai_areas, get_tx_data, persist_changes_dubai_areas
-from utils.formulas import percent_change
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
+
+from utils.db import (
+    CACHE_TTL,
+    clear_caches,
+    get_data_version,
+    get_dubai_areas,
+    get_map_data,
+    get_median_price_sqm,
+    get_period_metrics,
+    get_tx_data,
+    persist_changes_dubai_areas,
+)
+from utils.formulas import (
+    color_scale,
+    coordinates_key,
+    min_max_normalize,
+    percent_change_vec,
+)
 from utils.transformations import (
     augment_tx_data,
-    get_largest_tx,
-    get_median_price_sqm,
-    get_median_rental_value,
-    get_median_tx_value_per_sqm,
-    get_number_of_tx,
+    get_daily_counts,
     get_payment_type,
     get_reg_type,
     get_slice_of_data,
     get_top_projects,
     get_top_tx,
-    get_total_tx_value,
     get_tx_by_room_type,
     get_tx_by_type,
 )
 
+# --- usd amounts in the tables are formatted at render time, the data stays numeric
+USD_FORMAT = {"tx_value_usd": "{:,.0f}"}
+
 
 class QuickSelectTimeDelta(enum.Enum):
     LAST_DAY = "last day"
@@ -50,6 +68,139 @@ class DisplayUnits(enum.Enum):
     TX_VALUE = "Tx Value"
 
 
+@st.cache_data
+def _load_users_config() -> dict:
+    """Load the users/auth configuration once instead of on every rerun"""
+    file_path = Path(__file__).parent / "users.yaml"
+    with file_path.open("r") as file:
+        return yaml.load(file, Loader=SafeLoader)
+
+
+# --- figures are cached on their (small, aggregated) data, so unchanged data
+# doesn't rebuild them on every rerun
+@st.cache_data
+def _fig_tx_by_type(df: pd.DataFrame) -> go.Figure:
+    """Build the transactions by type figure"""
+    return px.bar(
+        data_frame=df,
+        title="Transactions by type",
+        x="tx_date",
+        y="tx_number",
+        color="prop_type",
+    )
+
+
+@st.cache_data
+def _fig_tx_by_room_type(df: pd.DataFrame) -> go.Figure:
+    """Build the transactions by room type figure"""
+    return px.bar(
+        data_frame=df,
+        title="By Room Type",
+        x="tx_number",
+        y="rooms",
+        orientation="h",
+        height=560,
+    )
+
+
+@st.cache_data
+def _fig_median_price(df: pd.DataFrame, area_units: str) -> go.Figure:
+    """Build the median price per area unit figure"""
+    return px.area(
+        data_frame=df,
+        title=f"Median Price per {area_units}",
+        x="tx_date",
+        y="price_sqm",
+    )
+
+
+@st.cache_data
+def _fig_payment_type(df: pd.DataFrame) -> go.Figure:
+    """Build the payment methods figure"""
+    return px.bar(
+        data_frame=df,
+        title="By Payment Method?",
+        x="tx_number",
+        y="payment_method_temp",
+        color="tx_type",
+        orientation="h",
+        height=270,
+        labels={"tx_type": "Quantity", "payment_method_temp": ""},
+    )
+
+
+@st.cache_data
+def _fig_reg_type(df: pd.DataFrame) -> go.Figure:
+    """Build the registration types figure"""
+    return px.bar(
+        data_frame=df,
+        title="By Registration",
+        x="tx_number",
+        y="reg_type_temp",
+        color="reg_type",
+        orientation="h",
+        height=270,
+        facet_col_spacing=0.9,
+        labels={"tx_number": "Quantity", "reg_type_temp": ""},
+    )
+
+
+@st.cache_data
+def _get_version() -> str:
+    """Get the installed dashboard version once instead of on every rerun"""
+    return version("dre_dashboard")
+
+
+@st.cache_resource(ttl=CACHE_TTL, show_spinner=True)
+def _load_tx() -> pd.DataFrame:
+    """Load the augmented transaction data once and share it across reruns and
+    sessions. The frame is not copied per rerun, so treat it as read-only."""
+    return augment_tx_data(get_tx_data())
+
+
+@st.cache_resource(ttl=CACHE_TTL, show_spinner=True)
+def _load_daily_counts() -> pd.Series:
+    """Pre-aggregate the daily chart counts once and share them across reruns and
+    sessions. Treat as read-only, like the transaction frame."""
+    return get_daily_counts(_load_tx())
+
+
+@st.cache_resource
+def _loaded_data_version() -> dict:
+    """The database version the cached data was loaded from, shared across
+    sessions"""
+    return {"version": None}
+
+
+def _clear_stale_caches() -> None:
+    """Clear all cached data together once the database has been refreshed, so
+    every part of the page shows the same snapshot of the data"""
+    data_version = get_data_version()
+    loaded = _loaded_data_version()
+    if loaded["version"] != data_version:
+        clear_caches()
+        _load_tx.clear()
+        _load_daily_counts.clear()
+        loaded["version"] = data_version
+
+
+@st.cache_data(ttl=3600, show_spinner=True)
+def _load_areas_polygons() -> pd.DataFrame:
+    """Load the dubai areas polygons once and reuse them across reruns, indexed by
+    their coordinates key"""
+    table = pq.read_table(
+        "res/dubai-areas-polygons.parquet",
+        columns=["area", "latitude", "longitude", "polygons"],
+    )
+    # --- pydeck can only serialize plain lists, not the nested numpy arrays
+    areas_polygons = table.drop(["polygons"]).to_pandas()
+    areas_polygons["polygons"] = table.column("polygons").to_pylist()
+    areas_polygons["key"] = coordinates_key(
+        areas_polygons["latitude"].to_numpy(), areas_polygons["longitude"].to_numpy()
+    )
+    return areas_polygons.set_index("key")[["area", "polygons"]]
+
+
 # --- session state configuration
 if "area_units" not in st.session_state:
     st.session_state.area_units = AreaUnits.SQ_METERS.value
@@ -92,9 +243,7 @@ def set_selected_date_values():
 st.set_page_config(page_title="DRE Insights Dashboard", page_icon="📈", layout="wide")
 
 # --- USER AUTHENTICATION
-file_path = Path(__file__).parent / "users.yaml"
-with file_path.open("r") as file:
-    config = yaml.load(file, Loader=SafeLoader)
+config = _load_users_config()
 
 authenticator = stauth.Authenticate(
     config["credentials"],
@@ -192,152 +341,94 @@ if authentication_status:
 
     # --- sidebar footer
     st.sidebar.markdown("---")
-    st.sidebar.caption(
-        f'Version: {pkg_resources.get_distribution("dre_dashboard").version}'
-    )
+    st.sidebar.caption(f"Version: {_get_version()}")
     authenticator.logout("Logout", "sidebar")
 
     # --- Main view
     st.write("# DRE Insights Dashboard")
     st.write("---")
 
-    tx_data = augment_tx_data(get_tx_data())
+    _clear_stale_caches()
+    tx_data = _load_tx()
+    daily_counts = _load_daily_counts()
     tx_data_slice = get_slice_of_data(
         df=tx_data, from_date=search_date_from, to_date=search_date_to
     )
 
+    metrics = get_period_metrics(from_date=search_date_from, to_date=search_date_to)
+    current_slice_metrics = metrics.loc["current"]
+
+    # --- percent change past -> current of all metrics in one vectorized op
+    percent_changes = pd.Series(
+        percent_change_vec(
+            metrics.loc["past"].to_numpy(dtype=float),
+            current_slice_metrics.to_numpy(dtype=float),
+        ),
+        index=metrics.columns,
+    )
+
     col1, col2, col3, col4, col5 = st.columns(5)
 
     # --- Total number of transactions
     with col1:
-        current_slice_number_of_tx = get_number_of_tx(
-            df=tx_data, from_date=search_date_from, to_date=search_date_to
-        )
-        past_slice_number_of_tx = get_number_of_tx(
-            df=tx_data,
-            from_date=search_date_from - (search_date_to - search_date_from),
-            to_date=search_date_from,
-        )
         st.metric(
             label="Number of Transactions",
-            value="{:,.0f}".format(current_slice_number_of_tx),
-            delta="{:.1f}%".format(
-                percent_change(
-                    x1=past_slice_number_of_tx,
-                    x2=current_slice_number_of_tx,
-                )
-            ),
+            value="{:,.0f}".format(current_slice_metrics["number_of_tx"]),
+            delta="{:.1f}%".format(percent_changes["number_of_tx"]),
         )
 
     # --- Total transaction value
     with col2:
-        current_slice_total_tx_value = get_total_tx_value(
-            df=tx_data, from_date=search_date_from, to_date=search_date_to
-        )
-        past_slice_total_tx_value = get_total_tx_value(
-            df=tx_data,
-            from_date=search_date_from - (search_date_to - search_date_from),
-            to_date=search_date_from,
-        )
         st.metric(
             label="Total Transaction Value",
-            value="${:,.0f}".format(current_slice_total_tx_value),
-            delta="{:.1f}%".format(
-                percent_change(
-                    x1=past_slice_total_tx_value,
-                    x2=current_slice_total_tx_value,
-                )
-            ),
+            value="${:,.0f}".format(current_slice_metrics["total_tx_value"]),
+            delta="{:.1f}%".format(percent_changes["total_tx_value"]),
         )
 
     # --- Median transaction value per sq. m.
     with col3:
-        current_slice_median_tx_value_per_sqm = get_median_tx_value_per_sqm(
-            df=tx_data, from_date=search_date_from, to_date=search_date_to
-        )
-        past_slice_median_tx_value_per_sqm = get_median_tx_value_per_sqm(
-            df=tx_data,
-            from_date=search_date_from - (search_date_to - search_date_from),
-            to_date=search_date_from,
-        )
         st.metric(
             label="Median Transaction Value (per sq. m.)",
-            value="${:,.0f}".format(current_slice_median_tx_value_per_sqm),
-            delta="{:.1f}%".format(
-                percent_change(
-                    x1=past_slice_median_tx_value_per_sqm,
-                    x2=current_slice_median_tx_value_per_sqm,
-                )
-            ),
+            value="${:,.0f}".format(current_slice_metrics["median_tx_value_per_sqm"]),
+            delta="{:.1f}%".format(percent_changes["median_tx_value_per_sqm"]),
         )
 
     # --- Median rental price
     with col4:
-        current_slice_median_rental_value = get_median_rental_value(
-            df=tx_data, from_date=search_date_from, to_date=search_date_to
-        )
-        past_slice_median_rental_value = get_median_rental_value(
-            df=tx_data,
-            from_date=search_date_from - (search_date_to - search_date_from),
-            to_date=search_date_from,
-        )
         st.metric(
             label="Median Rental Value",
-            value="${:,.0f}".format(current_slice_median_rental_value),
-            delta="{:.1f}%".format(
-                percent_change(
-                    x1=past_slice_median_rental_value,
-                    x2=current_slice_median_rental_value,
-                )
-            ),
+            value="${:,.0f}".format(current_slice_metrics["median_rental_value"]),
+            delta="{:.1f}%".format(percent_changes["median_rental_value"]),
         )
 
     # --- Largest transaction value
     with col5:
-        current_slice_largest_tx = get_largest_tx(
-            df=tx_data, from_date=search_date_from, to_date=search_date_to
-        )
-        past_slice_largest_tx = get_largest_tx(
-            df=tx_data,
-            from_date=search_date_from - (search_date_to - search_date_from),
-            to_date=search_date_from,
-        )
         st.metric(
             label="Largest Transaction",
-            value="${:,.0f}".format(current_slice_largest_tx),
-            delta="{:.1f}%".format(
-                percent_change(
-                    x1=past_slice_largest_tx,
-                    x2=current_slice_largest_tx,
-                )
-            ),
+            value="${:,.0f}".format(current_slice_metrics["largest_tx"]),
+            delta="{:.1f}%".format(percent_changes["largest_tx"]),
         )
 
     col1, col2 = st.columns(2)
 
     with col1:
         # --- Transaction type data figures
-        fig = px.bar(
-            title="Transactions by type",
-            data_frame=get_tx_by_type(
-                df=tx_data, from_date=search_date_from, to_date=search_date_to
-            ),
-            x="tx_date",
-            y="tx_number",
-            color="prop_type",
+        fig = _fig_tx_by_type(
+            get_tx_by_type(
+                daily_counts=daily_counts,
+                from_date=search_date_from,
+                to_date=search_date_to,
+            )
         )
         st.plotly_chart(fig, theme="streamlit")
 
         # --- by room type
-        fig = px.bar(
-            title="By Room Type",
-            data_frame=get_tx_by_room_type(
-                df=tx_data, from_date=search_date_from, to_date=search_date_to
-            ),
-            x="tx_number",
-            y="rooms",
-            orientation="h",
-            height=560,
+        fig = _fig_tx_by_room_type(
+            get_tx_by_room_type(
+                daily_counts=daily_counts,
+                from_date=search_date_from,
+                to_date=search_date_to,
+            )
         )
         st.plotly_chart(fig, theme="streamlit")
 
@@ -352,44 +443,29 @@ if authentication_status:
 
     with col2:
         # --- Median price per unit data figure
-        fig = px.area(
-            title=f"Median Price per {st.session_state.area_units}",
-            data_frame=get_median_price_sqm(
-                df=tx_data, from_date=search_date_from, to_date=search_date_to
-            ),
-            x="tx_date",
-            y="price_sqm",
+        fig = _fig_median_price(
+            get_median_price_sqm(from_date=search_date_from, to_date=search_date_to),
+            area_units=st.session_state.area_units,
         )
         st.plotly_chart(fig, theme="streamlit")
 
         # --- Payment method data figure
-        fig = px.bar(
-            title="By Payment Method?",
-            data_frame=get_payment_type(
-                df=tx_data, from_date=search_date_from, to_date=search_date_to
-            ),
-            x="tx_number",
-            y="payment_method_temp",
-            color="tx_type",
-            orientation="h",
-            height=270,
-            labels={"tx_type": "Quantity", "payment_method_temp": ""},
+        fig = _fig_payment_type(
+            get_payment_type(
+                daily_counts=daily_counts,
+                from_date=search_date_from,
+                to_date=search_date_to,
+            )
         )
         st.plotly_chart(fig, theme="streamlit")
 
         # --- Registration type data figure
-        fig = px.bar(
-            title="By Registration",
-            data_frame=get_reg_type(
-                df=tx_data, from_date=search_date_from, to_date=search_date_to
-            ),
-            x="tx_number",
-            y="reg_type_temp",
-            color="reg_type",
-            orientation="h",
-            height=270,
-            facet_col_spacing=0.9,
-            labels={"tx_number": "Quantity", "reg_type_temp": ""},
+        fig = _fig_reg_type(
+            get_reg_type(
+                daily_counts=daily_counts,
+                from_date=search_date_from,
+                to_date=search_date_to,
+            )
         )
         st.plotly_chart(fig, theme="streamlit")
 
@@ -399,9 +475,7 @@ if authentication_status:
         # --- Top 5 Transactions
         st.markdown("##### Top 5 Transactions")
         st.dataframe(
-            data=get_top_tx(
-                df=tx_data, from_date=search_date_from, to_date=search_date_to
-            ),
+            data=get_top_tx(df=tx_data_slice).style.format(USD_FORMAT),
             use_container_width=True,
         )
 
@@ -409,9 +483,7 @@ if authentication_status:
         # --- Top 5 Projects
         st.markdown("##### Top 5 Projects")
         st.dataframe(
-            data=get_top_projects(
-                df=tx_data, from_date=search_date_from, to_date=search_date_to
-            ),
+            data=get_top_projects(df=tx_data_slice).style.format(USD_FORMAT),
             use_container_width=True,
         )
 
@@ -419,18 +491,14 @@ if authentication_status:
     layers = []
     tooltip = {"text": "area: {area}"}
 
+    map_data = get_map_data(from_date=search_date_from, to_date=search_date_to)
+
     if display_units == DisplayUnits.TX_QTY:
-        # TODO: Move to transforms
-        df_temp = (
-            tx_data_slice[["latitude", "longitude", "tx_number"]][
-                tx_data_slice[["latitude", "longitude"]].notnull().all(1)
-            ]
-            .groupby(["latitude", "longitude"], as_index=False)
-            .count()
-        )
+        df_temp = map_data[["latitude", "longitude", "tx_number"]].copy()
 
-        df_temp["norm_count"] = (df_temp["tx_number"] - df_temp["tx_number"].min()) / (
-            df_temp["tx_number"].max() - df_temp["tx_number"].min()
+        df_temp["norm_count"] = min_max_normalize(df_temp["tx_number"].to_numpy())
+        df_temp["fill_r"], df_temp["fill_g"] = color_scale(
+            df_temp["norm_count"].to_numpy()
         )
 
         layers.append(
@@ -439,12 +507,7 @@ if authentication_status:
                 data=df_temp,
                 get_position="[longitude, latitude]",
                 get_elevation="norm_count",
-                get_fill_color=[
-                    "200 + norm_count * 50",
-                    "255 - norm_count * 255",
-                    0,
-                    130,
-                ],
+                get_fill_color=["fill_r", "fill_g", 0, 130],
                 radius=150,
                 elevation_scale=20000,
                 auto_highlight=True,
@@ -456,17 +519,13 @@ if authentication_status:
         tooltip["text"] += "\ntx_qty: {tx_number}"
 
     if display_units == DisplayUnits.TX_VALUE:
-        # TODO: Move to transforms
-        df_temp = (
-            tx_data_slice[["latitude", "longitude", "tx_value_usd"]][
-                tx_data_slice[["latitude", "longitude"]].notnull().all(1)
-            ]
-            .groupby(["latitude", "longitude"], as_index=False)
-            .sum("tx_value_usd")
+        df_temp = map_data[["latitude", "longitude", "tx_value_usd"]].copy()
+        df_temp["norm_tx_value_usd"] = min_max_normalize(
+            df_temp["tx_value_usd"].to_numpy()
+        )
+        df_temp["fill_r"], df_temp["fill_g"] = color_scale(
+            df_temp["norm_tx_value_usd"].to_numpy()
         )
-        df_temp["norm_tx_value_usd"] = (
-            df_temp["tx_value_usd"] - df_temp["tx_value_usd"].min()
-        ) / (df_temp["tx_value_usd"].max() - df_temp["tx_value_usd"].min())
 
         layers.append(
             pdk.Layer(
@@ -474,12 +533,7 @@ if authentication_status:
                 data=df_temp,
                 get_position="[longitude, latitude]",
                 get_elevation="norm_tx_value_usd",
-                get_fill_color=[
-                    "200 + norm_tx_value_usd * 50",
-                    "255 - norm_tx_value_usd * 255",
-                    0,
-                    130,
-                ],
+                get_fill_color=["fill_r", "fill_g", 0, 130],
                 radius=150,
                 elevation_scale=20000,
                 auto_highlight=True,
@@ -491,26 +545,18 @@ if authentication_status:
         tooltip["text"] += "\ntx_value_usd: {tx_value_usd}"
 
     if map_display_layer_price_sqm is True:
-        # TODO: move...
-        areas_polygons = pd.read_csv("res/dubai-areas-poygons.csv")
-        areas_polygons = areas_polygons[["area", "latitude", "longitude", "polygons"]]
-        areas_polygons["polygons"] = areas_polygons["polygons"].apply(
-            lambda x: ast.literal_eval(x)
-        )
+        areas_polygons = _load_areas_polygons()
 
-        df_temp = (
-            tx_data_slice[["latitude", "longitude", "price_sqm"]][
-                tx_data_slice[["latitude", "longitude"]].notnull().all(1)
-            ]
-            .groupby(["latitude", "longitude"], as_index=False)
-            .median("price_sqm")
+        df_temp = map_data[["latitude", "longitude", "price_sqm"]].copy()
+        df_temp["norm_price_sqm"] = min_max_normalize(df_temp["price_sqm"].to_numpy())
+        df_temp["fill_r"], df_temp["fill_g"] = color_scale(
+            df_temp["norm_price_sqm"].to_numpy()
         )
 
-        df_temp["norm_price_sqm"] = (
-            df_temp["price_sqm"] - df_temp["price_sqm"].min()
-        ) / (df_temp["price_sqm"].max() - df_temp["price_sqm"].min())
-
-        df_temp = df_temp.merge(areas_polygons, on=["latitude", "longitude"])
+        df_temp["key"] = coordinates_key(
+            df_temp["latitude"].to_numpy(), df_temp["longitude"].to_numpy()
+        )
+        df_temp = df_temp.join(areas_polygons, on="key", how="inner")
 
         layers.append(
             pdk.Layer(
@@ -523,12 +569,7 @@ if authentication_status:
                 stroked=False,
                 filled=True,
                 wireframe=True,
-                get_fill_color=[
-                    "200 + norm_price_sqm * 50",
-                    "255 - norm_price_sqm * 255",
-                    0,
-                    90,
-                ],
+                get_fill_color=["fill_r", "fill_g", 0, 90],
                 get_line_color=[255, 255, 255],
             )
         )
@@ -568,4 +609,5 @@ if authentication_status:
 
     # --- Table Data
     expander_data = st.expander("Raw Table Data")
-    expander_data.dataframe(tx_data_slice)
+    # --- tx_day is an internal day number, tx_ts already shows the date
+    expander_data.dataframe(tx_data_slice.drop(columns="tx_day"))
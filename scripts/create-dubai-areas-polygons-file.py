@@ -0,0 +1,30 @@
+import ast
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.logger import logger
+
+res_dir = Path(__file__).parent.parent / "res"
+source_file = res_dir / "dubai-areas-poygons.csv"
+output_file = res_dir / "dubai-areas-polygons.parquet"
+
+
+def create_file() -> None:
+    """Parse the polygons res data once and persist it as parquet."""
+
+    logger.info(f"parsing polygons from {source_file}")
+    df = pd.read_csv(source_file)
+    df = df[["area", "latitude", "longitude", "polygons"]]
+    df["polygons"] = df["polygons"].apply(ast.literal_eval)
+
+    # --- polygons are stored natively as list<list<list<double>>>
+    logger.info(f"writing {output_file}")
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), output_file)
+    logger.info(f"finished writing {output_file}")
+
+
+if __name__ == "__main__":
+    create_file()
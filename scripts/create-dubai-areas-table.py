@@ -2,6 +2,7 @@ from pathlib import Path
 
 import duckdb
 
+from utils import tx_joined
 from utils.logger import logger
 
 TABLE_NAME = "dubai_areas"
@@ -35,6 +36,9 @@ def create_table() -> None:
     con.execute(f"COPY {TABLE_NAME} FROM '{str(source_file)}' ;")
     logger.info(f"finished copying data into {TABLE_NAME}")
 
+    # --- keep the joined transactions in sync with the refreshed table
+    tx_joined.create_table(con)
+
 
 if __name__ == "__main__":
     create_table()
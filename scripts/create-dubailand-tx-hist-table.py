@@ -2,6 +2,7 @@ from pathlib import Path
 
 import duckdb
 
+from utils import tx_joined
 from utils.logger import logger
 
 TABLE_NAME = "dubailand_tx_hist"
@@ -9,6 +10,7 @@ TABLE_NAME = "dubailand_tx_hist"
 data_dir = Path(__file__).parent.parent / "data"
 db_file = data_dir / "dre.db"
 source_file = data_dir / "dubailand-tx-hist-data.csv"
+parquet_file = source_file.with_suffix(".parquet")
 
 FIELD_NAMES = {
     "transaction_number": "tx_number",
@@ -77,11 +79,29 @@ def create_table() -> None:
         ); """
     )
 
-    # --- copy data into db from new csv file
-    logger.info(f"copying data into {TABLE_NAME}")
-    con.execute(f"COPY {TABLE_NAME} FROM '{str(source_file)}' ( HEADER ) ;")
+    # --- the csv is only parsed once, rebuilds read the (typed) parquet copy,
+    # which may also be kept on its own
+    if parquet_file.exists() and (
+        not source_file.exists()
+        or parquet_file.stat().st_mtime >= source_file.stat().st_mtime
+    ):
+        logger.info(f"copying data into {TABLE_NAME} from {parquet_file}")
+        con.execute(
+            f"INSERT INTO {TABLE_NAME} SELECT * FROM read_parquet('{parquet_file}');"
+        )
+    else:
+        logger.info(f"copying data into {TABLE_NAME}")
+        con.execute(f"COPY {TABLE_NAME} FROM '{str(source_file)}' ( HEADER ) ;")
+        logger.info(f"writing {parquet_file}")
+        con.execute(
+            f"COPY {TABLE_NAME} TO '{parquet_file}' "
+            f"(FORMAT PARQUET, COMPRESSION ZSTD);"
+        )
     logger.info(f"finished copying data into {TABLE_NAME}")
 
+    # --- keep the joined transactions in sync with the refreshed table
+    tx_joined.create_table(con)
+
 
 if __name__ == "__main__":
     create_table()
@@ -0,0 +1,20 @@
+from pathlib import Path
+
+import duckdb
+
+from utils import tx_joined
+
+data_dir = Path(__file__).parent.parent / "data"
+db_file = data_dir / "dre.db"
+
+
+def create_table() -> None:
+    """(Re) create the tx_joined table in DuckDB. The sources and scripts
+    refreshing its source tables already do this, run it to rebuild manually."""
+
+    con = duckdb.connect(str(db_file.resolve()))
+    tx_joined.create_table(con)
+
+
+if __name__ == "__main__":
+    create_table()
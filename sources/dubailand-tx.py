@@ -1,3 +1,4 @@
+import shutil
 from datetime import date
 from pathlib import Path
 
@@ -5,6 +6,7 @@ import duckdb
 import pydantic as pyd
 import requests
 
+from utils import tx_joined
 from utils.logger import logger
 
 TABLE_NAME = "dubailand_tx"
@@ -98,9 +100,10 @@ def fetch(
 
         with requests.post(url=url, headers=headers, json=body, stream=True) as resp:
             resp.raise_for_status()
+            # --- let urllib3 decode gzip/br and copy in 1 MiB blocks
+            resp.raw.decode_content = True
             with open(output_file_name, "wb") as f:
-                for chunk in resp.iter_content():
-                    f.write(chunk)
+                shutil.copyfileobj(resp.raw, f, length=1024 * 1024)
 
     except Exception as e:
         logger.error("fetching data failed!")
@@ -157,11 +160,30 @@ def persist(data_file: Path) -> None:
         ); """
     )
 
-    # --- copy data into db from new csv file
-    logger.info(f"copying data into ")
-    con.execute(f"COPY {TABLE_NAME} FROM '{str(data_file)}' (AUTO_DETECT TRUE);")
+    # --- the csv is only parsed once, rebuilds read the (typed) parquet copy,
+    # which may also be kept on its own
+    parquet_file = data_file.with_suffix(".parquet")
+    if parquet_file.exists() and (
+        not data_file.exists()
+        or parquet_file.stat().st_mtime >= data_file.stat().st_mtime
+    ):
+        logger.info(f"copying data into {TABLE_NAME} from {parquet_file}")
+        con.execute(
+            f"INSERT INTO {TABLE_NAME} SELECT * FROM read_parquet('{parquet_file}');"
+        )
+    else:
+        logger.info(f"copying data into {TABLE_NAME}")
+        con.execute(f"COPY {TABLE_NAME} FROM '{str(data_file)}' (AUTO_DETECT TRUE);")
+        logger.info(f"writing {parquet_file}")
+        con.execute(
+            f"COPY {TABLE_NAME} TO '{parquet_file}' "
+            f"(FORMAT PARQUET, COMPRESSION ZSTD);"
+        )
     logger.info(f"finished copying data into {TABLE_NAME}")
 
+    # --- keep the joined transactions in sync with the refreshed table
+    tx_joined.create_table(con)
+
 
 if __name__ == "__main__":
     persist(data_file=fetch(no_download=False))
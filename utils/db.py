@@ -1,115 +1,252 @@
+import datetime
+from pathlib import Path
+from typing import Optional
+
 import duckdb
 import pandas as pd
+import pyarrow as pa
 import streamlit as st
 
+from utils import tx_joined
+from utils.formulas import AED_PER_USD
 
-@st.cache_data(ttl=300, show_spinner=True)
-def get_all_tx_data() -> pd.DataFrame:
-    """Get transaction data from DUckDB"""
+data_dir = Path(__file__).parent.parent / "data"
+db_file = data_dir / "dre.db"
 
-    query = """
-        WITH tx_data as (
-            SELECT
-                tx_number,
-                tx_ts,
-                tx_type,
-                tx_subtype,
-                reg_type,
-                is_free_hold,
-                usage,
-                area,
-                prop_type,
-                prop_subtype,
-                tx_value,
-                tx_size_sqm,
-                prop_size_sqm,
-                rooms,
-                parking,
-                near_metro,
-                near_mall,
-                near_landmark,
-                buy_count,
-                sell_count,
-                master_project,
-                project
-            FROM dubailand_tx_hist
-            UNION ALL
-            SELECT 
-                tx_number,
-                tx_ts,
-                tx_type,
-                tx_subtype,
-                reg_type,
-                is_free_hold,
-                usage,
-                area,
-                prop_type,
-                prop_subtype,
-                tx_value,
-                tx_size_sqm,
-                prop_size_sqm,
-                rooms,
-                parking,
-                near_metro,
-                near_mall,
-                near_landmark,
-                buy_count,
-                sell_count,
-                master_project,
-                project
-            FROM dubailand_tx )
-        SELECT tx.*, da."area" AS area_norm, da.latitude, da.longitude FROM tx_data tx
-        JOIN dubai_areas da
-        ON LOWER(tx.area) = da.area
-        ORDER BY tx.tx_ts ASC;
+# --- ttl of every cache holding data read from the database
+CACHE_TTL = 3600
+
+# --- transactions as loaded by get_tx_data, reduced to their (usd) prices
+# and area coordinates
+TX_PRICES_SQL = f"""
+    SELECT
+        dt.tx_ts,
+        dt.tx_value::DOUBLE / {AED_PER_USD} AS tx_value_usd,
+        dt.tx_value::DOUBLE / {AED_PER_USD} / dt.prop_size_sqm::DOUBLE AS price_sqm,
+        da.latitude,
+        da.longitude
+    FROM dubailand_tx dt
+    JOIN dubai_areas da
+    ON LOWER(dt.area) = da.area
+"""
+
+
+def get_connection() -> duckdb.DuckDBPyConnection:
+    """Get a short-lived read-only DuckDB connection.
+
+    DuckDB locks the database file for as long as a connection is open, and a
+    writer (the sources/scripts refreshing the data, or
+    persist_changes_dubai_areas) can't open it meanwhile. So connections are
+    not kept around, only the (cached) query results are."""
+    return duckdb.connect(str(db_file), read_only=True)
+
+
+def query(sql: str, params: Optional[list] = None) -> pa.Table:
+    """Run a (parameterized) query against DuckDB and get the result as Arrow"""
+    with get_connection() as con:
+        return con.execute(sql, params or []).arrow()
+
+
+def get_data_version() -> float:
+    """Get the modification time of the database file, which changes whenever the
+    data is refreshed"""
+    return db_file.stat().st_mtime
+
+
+def arrow_to_pandas(table: pa.Table) -> pd.DataFrame:
+    """Convert an Arrow table to pandas, keeping string columns Arrow-backed
+    instead of materializing a python object per value. Each column gets its own
+    block, so the numeric columns are not copied into one consolidated block."""
+    string_dtype = pd.StringDtype("pyarrow")
+    # --- no self_destruct: the source tables are cached and shared
+    return table.to_pandas(
+        split_blocks=True,
+        types_mapper={pa.string(): string_dtype, pa.large_string(): string_dtype}.get,
+    )
+
+
+@st.cache_resource(ttl=CACHE_TTL, show_spinner=True)
+def get_all_tx_data() -> pa.Table:
+    """Get the columns the dashboard uses of all (historical and current)
+    transaction data from DuckDB as Arrow, ordered by tx_ts (without NULLs)"""
+
+    # --- tx_joined is persisted ordered by tx_ts (utils/tx_joined.py, rebuilt
+    # whenever its source tables are refreshed) and plain scans preserve the
+    # insertion order, so no sort is needed here
+    sql = """
+        SELECT
+            tx_number,
+            tx_ts,
+            tx_type,
+            tx_subtype,
+            reg_type,
+            area,
+            prop_type,
+            prop_subtype,
+            tx_value,
+            tx_size_sqm,
+            prop_size_sqm,
+            rooms,
+            project
+        FROM tx_joined
+        WHERE tx_ts IS NOT NULL;
     """
 
-    with duckdb.connect("data/dre.db", read_only=True) as con:
-        return con.sql(query).df()
+    return query(sql)
 
 
-@st.cache_data(ttl=300, show_spinner=True)
-def get_tx_data() -> pd.DataFrame:
-    """Get transaction data from DuckDB"""
+@st.cache_resource(ttl=CACHE_TTL, show_spinner=True)
+def get_tx_data() -> pa.Table:
+    """Get the columns the dashboard uses of the transaction data from DuckDB as
+    Arrow, ordered by tx_ts (without NULLs, which DuckDB would sort first). The
+    join keeps only transactions in known areas."""
 
-    query = """
-        SELECT dt.*, da."area" AS area_norm, da.latitude, da.longitude FROM dubailand_tx dt
+    sql = """
+        SELECT
+            dt.tx_number,
+            dt.tx_ts,
+            dt.tx_type,
+            dt.tx_subtype,
+            dt.reg_type,
+            dt.area,
+            dt.prop_type,
+            dt.prop_subtype,
+            dt.tx_value::DOUBLE AS tx_value,
+            dt.tx_size_sqm::DOUBLE AS tx_size_sqm,
+            dt.prop_size_sqm::DOUBLE AS prop_size_sqm,
+            dt.rooms,
+            dt.project
+        FROM dubailand_tx dt
         JOIN dubai_areas da
         ON LOWER(dt.area) = da.area
+        WHERE dt.tx_ts IS NOT NULL
         ORDER BY dt.tx_ts ASC;
     """
 
-    with duckdb.connect("data/dre.db", read_only=True) as con:
-        return con.sql(query).df()
+    return query(sql)
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=True)
+def get_period_metrics(
+    from_date: datetime.date, to_date: datetime.date
+) -> pd.DataFrame:
+    """Get the key metrics for the provided date range ("current") and for the
+    range of the same length right before it ("past") in a single query"""
+
+    sql = f"""
+        SELECT
+            CASE WHEN tx_ts >= $2 THEN 'current' ELSE 'past' END AS period,
+            count(*) AS number_of_tx,
+            sum(tx_value_usd) AS total_tx_value,
+            median(price_sqm) AS median_tx_value_per_sqm,
+            max(tx_value_usd) AS largest_tx,
+            0.0 AS median_rental_value -- TODO: get data from rental data-set
+        FROM ({TX_PRICES_SQL}) tx
+        WHERE tx_ts >= $1 AND tx_ts < $3
+        GROUP BY period;
+    """
+
+    # --- both ranges span (to_date - from_date + 1) days
+    params = [
+        from_date - (to_date - from_date) - datetime.timedelta(days=1),
+        from_date,
+        to_date + datetime.timedelta(days=1),
+    ]
+    return (
+        query(sql, params)
+        .to_pandas()
+        .set_index("period")
+        .reindex(["current", "past"])
+        .fillna({"number_of_tx": 0, "total_tx_value": 0.0, "median_rental_value": 0.0})
+    )
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=True)
+def get_median_price_sqm(
+    from_date: datetime.date, to_date: datetime.date
+) -> pd.DataFrame:
+    """Get the daily median price of square meter for the provided date range"""
+
+    sql = f"""
+        SELECT
+            strftime(tx_ts::DATE, '%Y-%m-%d') AS tx_date,
+            median(price_sqm) AS price_sqm
+        FROM ({TX_PRICES_SQL}) tx
+        WHERE tx_ts >= $1 AND tx_ts < $2 AND price_sqm IS NOT NULL
+        GROUP BY tx_ts::DATE
+        ORDER BY tx_ts::DATE ASC;
+    """
+
+    params = [from_date, to_date + datetime.timedelta(days=1)]
+    return query(sql, params).to_pandas()
+
 
+@st.cache_data(ttl=CACHE_TTL, show_spinner=True)
+def get_map_data(from_date: datetime.date, to_date: datetime.date) -> pd.DataFrame:
+    """Get the number of transactions, their total value and the median price of
+    square meter per area coordinates for the provided date range"""
+
+    sql = f"""
+        SELECT
+            latitude,
+            longitude,
+            count(*) AS tx_number,
+            sum(tx_value_usd) AS tx_value_usd,
+            median(price_sqm) AS price_sqm
+        FROM ({TX_PRICES_SQL}) tx
+        WHERE tx_ts >= $1 AND tx_ts < $2
+            AND latitude IS NOT NULL AND longitude IS NOT NULL
+        GROUP BY latitude, longitude;
+    """
 
-@st.cache_data(ttl=300, show_spinner=True)
+    params = [from_date, to_date + datetime.timedelta(days=1)]
+    return query(sql, params).to_pandas()
+
+
+@st.cache_resource(ttl=CACHE_TTL, show_spinner=True)
 def get_dubai_areas() -> pd.DataFrame:
     """Get Dubai areas/coordinates data from DuckDB"""
 
-    query = """
+    sql = """
         SELECT *
         FROM dubai_areas da
         ORDER BY area ASC;
     """
 
-    with duckdb.connect("data/dre.db", read_only=True) as con:
-        return con.sql(query).df()
+    return query(sql).to_pandas()
 
 
 def persist_changes_dubai_areas(df: pd.DataFrame) -> None:
     """Save any changes to the dubai areas table in DuckDB."""
 
-    with duckdb.connect("data/dre.db", read_only=False) as con:
-        con.execute(f"DROP TABLE IF EXISTS dubai_areas;")
+    # --- the replaced table has no constraints, so check them up front
+    if df["area"].isna().any() or df["area"].duplicated().any():
+        raise ValueError("dubai areas must be unique and not null")
+
+    with duckdb.connect(str(db_file), read_only=False) as con:
+        con.register("df", df)
         con.execute(
-            f"""
-            CREATE TABLE dubai_areas (
-                "area" varchar unique not null,
-                "latitude" FLOAT8,
-                "longitude" FLOAT8
-            );
+            """
+            CREATE OR REPLACE TABLE dubai_areas AS
+            SELECT
+                area::VARCHAR AS area,
+                latitude::DOUBLE AS latitude,
+                longitude::DOUBLE AS longitude
+            FROM df;
             """
         )
-        con.register("df", df)
-        con.execute(f"INSERT INTO dubai_areas SELECT * FROM df;")
+        tx_joined.create_table(con)
+
+
+def clear_caches() -> None:
+    """Clear the cached results of every query, so they are all read again from
+    the same (refreshed) data"""
+    for func in (
+        get_all_tx_data,
+        get_tx_data,
+        get_period_metrics,
+        get_median_price_sqm,
+        get_map_data,
+        get_dubai_areas,
+    ):
+        func.clear()
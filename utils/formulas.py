@@ -1,6 +1,46 @@
+from typing import Tuple
+
+import numpy as np
+
+AED_PER_USD = 3.6725  # TODO: fetch dynamically
+
+
 def percent_change(x1: float, x2: float) -> float:
     """Calulates the percent change from x1 -> x2"""
     if x1 == 0:
         return 0
 
     return (x2 - x1) / x1 * 100
+
+
+def percent_change_vec(x1: np.ndarray, x2: np.ndarray) -> np.ndarray:
+    """Calulates the element-wise percent change from x1 -> x2 (0 where x1 is 0)"""
+    return np.divide(100 * (x2 - x1), x1, out=np.zeros(x1.shape), where=x1 != 0)
+
+
+def min_max_normalize(x: np.ndarray) -> np.ndarray:
+    """Scales the values of x linearly to the [0, 1] range, ignoring NaNs"""
+    if x.size == 0:
+        return x.astype(float)
+
+    lo = np.nanmin(x)
+    spread = np.nanmax(x) - lo
+    if spread == 0:
+        return np.zeros(x.shape)
+
+    return (x - lo) / spread
+
+
+def color_scale(x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Gets the red and green channels of the map color scale for values
+    normalized to the [0, 1] range (NaNs get the color of 0)"""
+    x = np.nan_to_num(x)
+    return (200 + x * 50).astype(np.uint8), (255 - x * 255).astype(np.uint8)
+
+
+def coordinates_key(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """Packs coordinates rounded to 6 decimals into a single int64 key, so they can
+    be joined on without hashing (or comparing) float pairs"""
+    return np.round(latitude * 1e6).astype(np.int64) * 10**9 + np.round(
+        longitude * 1e6
+    ).astype(np.int64)
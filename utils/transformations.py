@@ -1,130 +1,155 @@
 import datetime
-from typing import Optional
+from typing import List, Optional
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import streamlit
 
+from utils.db import arrow_to_pandas
+from utils.formulas import AED_PER_USD
 
-@streamlit.cache_data
-def augment_tx_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Adds the following new columns to the transactions dataframe:
+# --- repeated string columns stored as categoricals
+CATEGORY_COLUMNS = [
+    "prop_type",
+    "prop_subtype",
+    "tx_type",
+    "tx_subtype",
+    "reg_type",
+    "rooms",
+    "area",
+    "project",
+]
+
+# --- categories the charts count transactions by
+DAILY_COUNTS_COLUMNS = ["prop_type", "rooms", "tx_type", "reg_type"]
+
+# --- tx_day counts the days since this date
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def augment_tx_data(table: pa.Table) -> pd.DataFrame:
+    """Adds the following new columns to the Arrow transactions table:
     - week_number
-    - tx_date (YYYY-MM-DD)
+    - tx_day (days since 1970-01-01)
     - tx_value_usd
     - price_sqm
+    then converts it to a dataframe once and encodes the repeated string columns
+    as categoricals
     """
-    df["week_number"] = df["tx_ts"].dt.isocalendar().week
-    df["tx_date"] = df["tx_ts"].dt.strftime("%Y-%m-%d")
-    df["tx_value_usd"] = df["tx_value"] / 3.6725  # TODO: fetch dynamically
-    df["price_sqm"] = df["tx_value_usd"] / df["prop_size_sqm"]
+    # --- derived with Arrow compute kernels, before the pandas conversion
+    tx_value_usd = pc.divide(table["tx_value"], AED_PER_USD)
+    table = (
+        table.append_column("week_number", pc.iso_week(table["tx_ts"]))
+        .append_column(
+            "tx_day", pc.cast(pc.cast(table["tx_ts"], pa.date32()), pa.int32())
+        )
+        .append_column("tx_value_usd", tx_value_usd)
+        .append_column("price_sqm", pc.divide(tx_value_usd, table["prop_size_sqm"]))
+    )
+
+    df = arrow_to_pandas(table)
+    for column in CATEGORY_COLUMNS:
+        df[column] = df[column].astype("category")
     return df
 
 
-@streamlit.cache_data
 def get_slice_of_data(
     df: pd.DataFrame, from_date: datetime.date, to_date: datetime.date
 ) -> pd.DataFrame:
-    """Gets the section of the data for the provided week"""
-    return df.loc[(df.tx_ts.dt.date >= from_date) & (df.tx_ts.dt.date <= to_date)]
-
-
-@streamlit.cache_data
-def get_number_of_tx(
-    df: pd.DataFrame, from_date: datetime.date, to_date: datetime.date
-) -> int:
-    """Gets the total number of transactions for the provided date range"""
-    return df.loc[
-        (df.tx_ts.dt.date >= from_date) & (df.tx_ts.dt.date <= to_date)
-    ].shape[0]
-
-
-@streamlit.cache_data
-def get_total_tx_value(
-    df: pd.DataFrame, from_date: datetime.date, to_date: datetime.date
-) -> float:
-    """Gets the total value of transactions for the provided date range"""
-    return df.loc[(df.tx_ts.dt.date >= from_date) & (df.tx_ts.dt.date <= to_date)][
-        "tx_value_usd"
-    ].sum()
-
-
-@streamlit.cache_data
-def get_median_tx_value_per_sqm(
-    df: pd.DataFrame, from_date: datetime.date, to_date: datetime.date
-) -> float:
-    """Gets the median transaction value per sq. m. for the provided date range"""
-    return df.loc[(df.tx_ts.dt.date >= from_date) & (df.tx_ts.dt.date <= to_date)][
-        "price_sqm"
-    ].median(0, numeric_only=True)
+    """Gets the section of the data for the provided date range. The data must be
+    sorted by tx_ts ascending without NaT values (as loaded by get_tx_data), so
+    the range is found with a binary search and returned as a positional slice
+    instead of evaluating a mask over every row."""
+    lo, hi = np.searchsorted(
+        df["tx_ts"].to_numpy(),
+        [
+            np.datetime64(from_date, "ns"),
+            np.datetime64(to_date + datetime.timedelta(days=1), "ns"),
+        ],
+    )
+    return df.iloc[lo:hi]
 
 
-@streamlit.cache_data
-def get_median_rental_value(
-    df: pd.DataFrame, from_date: datetime.date, to_date: datetime.date
-) -> float:
-    """Gets the median rental transaction value for the provided date range"""
-    # TODO: get data from rental data-set
-    return 0.0
+def get_daily_counts(df: pd.DataFrame) -> pd.Series:
+    """Counts the transactions per day and combination of the chart categories,
+    so the charts only have to sum up this small pre-aggregated table"""
+    # --- grouped by the category codes, so missing categories (-1) are kept
+    # rather than dropping the whole row from the other categories' counts
+    daily_counts = (
+        df.groupby(
+            [
+                df["tx_day"],
+                *(df[c].cat.codes.rename(c) for c in DAILY_COUNTS_COLUMNS),
+            ]
+        )
+        .size()
+        .reset_index(name="tx_number")
+    )
+    for column in DAILY_COUNTS_COLUMNS:
+        daily_counts[column] = pd.Categorical.from_codes(
+            daily_counts[column], categories=df[column].cat.categories
+        )
+    return daily_counts.set_index(["tx_day", *DAILY_COUNTS_COLUMNS])["tx_number"]
 
 
-@streamlit.cache_data
-def get_largest_tx(
-    df: pd.DataFrame, from_date: datetime.date, to_date: datetime.date
-) -> float:
-    """Gets the largest transaction value for the provided date range"""
-    return df.loc[(df.tx_ts.dt.date >= from_date) & (df.tx_ts.dt.date <= to_date)][
-        "tx_value_usd"
-    ].max(numeric_only=True)
+def sum_daily_counts(
+    daily_counts: pd.Series,
+    from_date: datetime.date,
+    to_date: datetime.date,
+    by: List[str],
+) -> pd.DataFrame:
+    """Sums the daily counts of the provided date range by the provided levels"""
+    return (
+        daily_counts.loc[(from_date - EPOCH).days : (to_date - EPOCH).days]
+        .groupby(level=by, observed=True)
+        .sum()
+        .reset_index(name="tx_number")
+    )
 
 
 @streamlit.cache_data
 def get_tx_by_type(
-    df: pd.DataFrame, from_date: datetime.date, to_date: datetime.date
+    daily_counts: pd.Series, from_date: datetime.date, to_date: datetime.date
 ) -> pd.DataFrame:
     """Get the transactions grouped by type for the provided date range"""
-    return (
-        df.loc[(df.tx_ts.dt.date >= from_date) & (df.tx_ts.dt.date <= to_date)]
-        .groupby(["prop_type", "tx_date"], as_index=False)
-        .count()
+    df_temp = sum_daily_counts(
+        daily_counts, from_date, to_date, ["prop_type", "tx_day"]
     )
+    # --- only the (small) aggregated result is formatted as YYYY-MM-DD
+    df_temp["tx_day"] = pd.to_datetime(df_temp["tx_day"], unit="D").dt.strftime(
+        "%Y-%m-%d"
+    )
+    return df_temp.rename(columns={"tx_day": "tx_date"})
 
 
 @streamlit.cache_data
 def get_reg_type(
-    df: pd.DataFrame, from_date: datetime.date, to_date: datetime.date
+    daily_counts: pd.Series, from_date: datetime.date, to_date: datetime.date
 ) -> pd.DataFrame:
     """Get the transactions grouped by registration type for the provided date range"""
-    df_temp = (
-        df.loc[(df.tx_ts.dt.date >= from_date) & (df.tx_ts.dt.date <= to_date)]
-        .groupby("reg_type", as_index=False)
-        .count()
-    )
+    df_temp = sum_daily_counts(daily_counts, from_date, to_date, ["reg_type"])
     df_temp["reg_type_temp"] = ""
     return df_temp
 
 
 @streamlit.cache_data
 def get_payment_type(
-    df: pd.DataFrame, from_date: datetime.date, to_date: datetime.date
+    daily_counts: pd.Series, from_date: datetime.date, to_date: datetime.date
 ) -> pd.DataFrame:
     """Get the payment methods used the provided date range"""
-    df_temp = (
-        df.loc[(df.tx_ts.dt.date >= from_date) & (df.tx_ts.dt.date <= to_date)]
-        .groupby("tx_type", as_index=False)
-        .count()
-    )
+    df_temp = sum_daily_counts(daily_counts, from_date, to_date, ["tx_type"])
     df_temp["payment_method_temp"] = ""
     return df_temp
 
 
 @streamlit.cache_data
 def record_sale(df: pd.DataFrame):
-    df = df[(df["prop_type"] != "Land")]
-    df = df.sort_values(by=["tx_value"], ascending=False)
-    df = df[:5]
-    df = df[
+    df = df.loc[
+        df["prop_type"] != "Land",
         [
-            "tx_date",
+            "tx_ts",
             "project",
             "tx_value",
             "tx_value_usd",
@@ -133,79 +158,39 @@ def record_sale(df: pd.DataFrame):
             "tx_subtype",
             "rooms",
             "week_number",
-        ]
+        ],
     ]
-    df["tx_value"] = df["tx_value"].map("{:,.0f}".format)
-    df["tx_value_usd"] = df["tx_value_usd"].map("{:,.0f}".format)
-    return df
+    return df.nlargest(5, "tx_value")
 
 
 @streamlit.cache_data
-def get_median_price_sqm(
-    df: pd.DataFrame, from_date: datetime.date, to_date: datetime.date
-) -> pd.DataFrame:
-    """Get median price of square meter for the provided date range"""
-    return (
-        df[["tx_date", "price_sqm"]]
-        .loc[(df.tx_ts.dt.date >= from_date) & (df.tx_ts.dt.date <= to_date)]
-        .groupby(["tx_date"], as_index=False)
-        .median(numeric_only=True)
-    )
+def get_top_tx(df: pd.DataFrame, top: Optional[int] = 5) -> pd.DataFrame:
+    """Get top transactions of the provided slice of data to display"""
+    # --- filtered and reduced to the displayed columns in a single selection
+    df_temp = df.loc[
+        df["prop_type"] != "Land",
+        ["project", "area", "tx_value_usd", "tx_size_sqm", "prop_subtype"],
+    ].nlargest(top, "tx_value_usd")
+    return df_temp.set_index(pd.Index(list(range(1, len(df_temp) + 1))))
 
 
 @streamlit.cache_data
-def get_top_tx(
-    df: pd.DataFrame,
-    from_date: datetime.date,
-    to_date: datetime.date,
-    top: Optional[int] = 5,
-) -> pd.DataFrame:
-    """Get top transactions to display"""
+def get_top_projects(df: pd.DataFrame, top: Optional[int] = 5) -> pd.DataFrame:
+    """Get top projects of the provided slice of data to display"""
     df_temp = (
-        df[(df["prop_type"] != "Land")]
-        .loc[(df.tx_ts.dt.date >= from_date) & (df.tx_ts.dt.date <= to_date)]
-        .sort_values(by=["tx_value_usd"], ascending=False)[:top][
-            [
-                "project",
-                "area",
-                "tx_value_usd",
-                "tx_size_sqm",
-                "prop_subtype",
-            ]
-        ]
-    )
-    df_temp["tx_value_usd"] = df_temp["tx_value_usd"].map("{:,.0f}".format)
-    return df_temp.set_index(pd.Index(list(range(1, top + 1))))
-
-
-@streamlit.cache_data
-def get_top_projects(
-    df: pd.DataFrame,
-    from_date: datetime.date,
-    to_date: datetime.date,
-    top: Optional[int] = 5,
-) -> pd.DataFrame:
-    """Get top projects to display"""
-    df_temp = (
-        df.loc[(df.tx_ts.dt.date >= from_date) & (df.tx_ts.dt.date <= to_date)]
-        .groupby("project")
-        .agg({"tx_number": "count", "tx_value_usd": "sum"})
+        df.groupby("project", observed=True)
+        .agg(units_sold=("tx_number", "size"), tx_value_usd=("tx_value_usd", "sum"))
+        .nlargest(top, "units_sold")
         .reset_index()
-        .rename(columns={"tx_number": "units_sold"})
-        .sort_values("units_sold", ascending=False)[:top]
     )
-    df_temp["tx_value_usd"] = df_temp["tx_value_usd"].map("{:,.0f}".format)
-    return df_temp.set_index(pd.Index(list(range(1, top + 1))))
+    return df_temp.set_index(pd.Index(list(range(1, len(df_temp) + 1))))
 
 
 @streamlit.cache_data
 def get_tx_by_room_type(
-    df: pd.DataFrame, from_date: datetime.date, to_date: datetime.date
+    daily_counts: pd.Series, from_date: datetime.date, to_date: datetime.date
 ) -> pd.DataFrame:
-    """Get median price of square meter for the provided date range"""
-    return (
-        df.loc[(df.tx_ts.dt.date >= from_date) & (df.tx_ts.dt.date <= to_date)]
-        .groupby(["rooms"], as_index=False)
-        .count()
-        .sort_values(by=["rooms"], ascending=False)
+    """Get the transactions grouped by room type for the provided date range"""
+    return sum_daily_counts(daily_counts, from_date, to_date, ["rooms"]).sort_values(
+        by=["rooms"], ascending=False
     )
@@ -0,0 +1,79 @@
+import duckdb
+
+from utils.logger import logger
+
+TABLE_NAME = "tx_joined"
+
+# --- tables tx_joined is built from
+SOURCE_TABLES = {"dubailand_tx_hist", "dubailand_tx", "dubai_areas"}
+
+# --- columns shared by the historical and the current transactions tables
+TX_COLUMNS = [
+    "tx_number",
+    "tx_ts",
+    "tx_type",
+    "tx_subtype",
+    "reg_type",
+    "is_free_hold",
+    "usage",
+    "area",
+    "prop_type",
+    "prop_subtype",
+    "tx_value",
+    "tx_size_sqm",
+    "prop_size_sqm",
+    "rooms",
+    "parking",
+    "near_metro",
+    "near_mall",
+    "near_landmark",
+    "buy_count",
+    "sell_count",
+    "master_project",
+    "project",
+]
+
+
+def create_table(con: duckdb.DuckDBPyConnection) -> None:
+    """Persist all transactions joined with the dubai areas, ordered by tx_ts, so
+    the dashboard does not recompute the join and sort on every load. Called
+    whenever one of the source tables is refreshed."""
+
+    tables = {
+        row[0]
+        for row in con.execute(
+            "SELECT table_name FROM information_schema.tables;"
+        ).fetchall()
+    }
+    missing_tables = SOURCE_TABLES - tables
+    if missing_tables:
+        logger.warning(f"not creating {TABLE_NAME}, missing {missing_tables}")
+        return
+
+    columns = ", ".join(TX_COLUMNS)
+
+    logger.info(f"creating or replacing {TABLE_NAME}")
+    con.execute(
+        f"""
+        CREATE OR REPLACE TABLE {TABLE_NAME} AS
+        WITH tx_data AS (
+            SELECT {columns} FROM dubailand_tx_hist
+            UNION ALL
+            SELECT {columns} FROM dubailand_tx
+        )
+        SELECT
+            tx.* REPLACE (
+                tx.tx_value::DOUBLE AS tx_value,
+                tx.tx_size_sqm::DOUBLE AS tx_size_sqm,
+                tx.prop_size_sqm::DOUBLE AS prop_size_sqm
+            ),
+            da."area" AS area_norm,
+            da.latitude,
+            da.longitude
+        FROM tx_data tx
+        JOIN dubai_areas da
+        ON LOWER(tx.area) = da.area
+        ORDER BY tx.tx_ts ASC;
+        """
+    )
+    logger.info(f"finished creating {TABLE_NAME}")